@@ -0,0 +1,108 @@
+import multiprocessing
+
+import numpy as np
+import scipy.stats as sci_stats
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+# default cap on the number of points drawn in any one diagnostic plot
+DEFAULT_MAX_POINTS = 5000
+
+
+def decimate(values: np.ndarray, max_points=DEFAULT_MAX_POINTS) -> np.ndarray:
+    """ indices of at most max_points samples of values, for plotting. The
+    minimum and maximum of each bucket are kept, so spikes (like gaps) survive. """
+    len_values = len(values)
+    if max_points is None or len_values <= max_points:
+        return np.arange(0, len_values)
+    num_buckets = max(max_points // 2, 1)
+    edges = np.linspace(0, len_values, num_buckets + 1).astype(int)
+    starts = edges[:-1]
+    # reduceat needs non-empty buckets; with len_values > max_points they all are
+    bucket_min = np.minimum.reduceat(values, starts)
+    bucket_max = np.maximum.reduceat(values, starts)
+    indices = []
+    for ind_bucket, start in enumerate(starts):
+        bucket = values[start:edges[ind_bucket + 1]]
+        indices.append(start + int(np.argmax(bucket == bucket_min[ind_bucket])))
+        indices.append(start + int(np.argmax(bucket == bucket_max[ind_bucket])))
+    return np.unique(indices)
+
+
+def _stride(len_values: int, max_points) -> np.ndarray:
+    """ evenly spaced indices of at most max_points samples """
+    if max_points is None or len_values <= max_points:
+        return np.arange(0, len_values)
+    return np.unique(np.linspace(0, len_values - 1, max_points).astype(int))
+
+
+def plot_point_stats(
+        plot_file: str,
+        delta_dist: np.ndarray,
+        smad_factor=2,
+        title='query-reference distance along alignment',
+        xlabel='alignment index',
+        max_points=DEFAULT_MAX_POINTS):
+    """ headless, decimated version of the get_point_stats plot, written to plot_file """
+    delta_dist_median = np.median(delta_dist)
+    delta_dist_smad = sci_stats.median_abs_deviation(delta_dist, scale='normal')
+    x = decimate(delta_dist, max_points)
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(x, delta_dist[x])
+    ax.axhline(delta_dist_median, color='r')
+    ax.axhline(delta_dist_median + delta_dist_smad * smad_factor, color='r', linestyle='--')
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('dist')
+    fig.savefig(plot_file)
+
+
+def plot_alignment(
+        plot_file: str,
+        query: np.ndarray,
+        template: np.ndarray,
+        index1: np.ndarray,
+        index2: np.ndarray,
+        max_points=DEFAULT_MAX_POINTS):
+    """ headless, decimated version of the dtw threeway alignment plot, written to plot_file """
+    fig = Figure(figsize=(8, 8))
+    FigureCanvasAgg(fig)
+    grid = fig.add_gridspec(2, 2, width_ratios=[1, 3], height_ratios=[3, 1])
+    ax_path = fig.add_subplot(grid[0, 1])
+    ax_template = fig.add_subplot(grid[0, 0], sharey=ax_path)
+    ax_query = fig.add_subplot(grid[1, 1], sharex=ax_path)
+    path = _stride(len(index1), max_points)
+    ax_path.plot(index1[path], index2[path])
+    ax_path.set_title('alignment')
+    qx = _stride(query.shape[0], max_points)
+    ax_query.plot(qx, query[qx, :])
+    ax_query.set_xlabel('query index')
+    tx = _stride(template.shape[0], max_points)
+    ax_template.plot(template[tx, :], tx)
+    ax_template.set_ylabel('reference index')
+    fig.savefig(plot_file)
+
+
+def render_alignment_diagnostics(
+        output_name: str,
+        query: np.ndarray,
+        template: np.ndarray,
+        index1: np.ndarray,
+        index2: np.ndarray,
+        aligned_distance: np.ndarray,
+        max_points=DEFAULT_MAX_POINTS):
+    """ write the alignment and aligned distance plots for output_name """
+    plot_alignment(output_name + '.alignment.png', query, template, index1, index2, max_points)
+    plot_point_stats(output_name + '.point_stats.png', aligned_distance, max_points=max_points)
+
+
+def render_in_background(target, *args, **kwargs) -> multiprocessing.Process:
+    """ run a plotting function in a separate process, so the patching path is
+    not slowed down or blocked by rendering. The process is not a daemon, so
+    the interpreter waits for the plots to be written before exiting. """
+    worker = multiprocessing.Process(target=target, args=args, kwargs=kwargs, name='gpx_diagnostics')
+    worker.start()
+    return worker
@@ -0,0 +1,138 @@
+import xml.etree.ElementTree as ET
+import collections
+import gzip
+import bz2
+import lzma
+import os
+
+import gpxpy as gp
+from gpxpy import gpxfield as gp_field
+
+
+# a lightweight track point - just the fields the patchers actually use
+TrackPoint = collections.namedtuple('TrackPoint', ['latitude', 'longitude', 'elevation', 'time'])
+
+# the track point fields which can be requested from parse_gpx
+POSITION_FIELDS = TrackPoint._fields
+
+
+# compression codecs, chosen by file extension
+_COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def open_gpx(file_name, mode='r'):
+    """ open a gpx file, transparently (de)compressing .gz, .bz2 and .xz files
+    as a stream. Text mode is the default, as with open(). """
+    opener = _COMPRESSED_OPENERS.get(os.path.splitext(file_name)[1].lower())
+    if opener is None:
+        return open(file_name, mode)
+    if 'b' not in mode and 't' not in mode:
+        # the compressed openers default to binary mode
+        mode += 't'
+    return opener(file_name, mode)
+
+
+def strip_gpx_extension(file_name):
+    """ strip any compression extension and then the gpx extension - e.g.
+    ride.gpx.gz -> ride. Used for naming the html and png side outputs. """
+    base, ext = os.path.splitext(file_name)
+    if ext.lower() in _COMPRESSED_OPENERS:
+        base = os.path.splitext(base)[0]
+    return base
+
+
+def _namespace(tag: str) -> str:
+    """ the '{uri}' namespace prefix of an element tag, or '' """
+    if tag.startswith('{'):
+        return tag[:tag.index('}') + 1]
+    return ''
+
+
+def iter_track_points(gpx_file):
+    """ stream the points of the first track segment of a gpx file without
+    building the full gpxpy object tree. gpx_file can be a file name or an
+    open file object; compressed files are decompressed on the fly. Elements
+    are discarded as soon as they are read, so memory use does not grow with
+    the length of the track. """
+    if isinstance(gpx_file, str):
+        with open_gpx(gpx_file, 'rb') as f:
+            yield from iter_track_points(f)
+        return
+    context = ET.iterparse(gpx_file, events=('start', 'end'))
+    # the root element fixes the gpx namespace, so tags can be compared directly
+    _, root = next(context)
+    ns = _namespace(root.tag)
+    trkseg_tag = ns + 'trkseg'
+    trkpt_tag = ns + 'trkpt'
+    ele_tag = ns + 'ele'
+    time_tag = ns + 'time'
+    segment = None
+    for event, elem in context:
+        tag = elem.tag
+        if event == 'start':
+            if tag == trkseg_tag:
+                segment = elem
+            continue
+        if tag == trkseg_tag:
+            # like the patchers, only consider the first track segment
+            return
+        if segment is None or tag != trkpt_tag:
+            continue
+        elevation = None
+        time = None
+        for child in elem:
+            if child.tag == ele_tag and child.text:
+                elevation = float(child.text)
+            elif child.tag == time_tag and child.text:
+                time = gp_field.parse_time(child.text.strip())
+        yield TrackPoint(float(elem.get('lat')), float(elem.get('lon')), elevation, time)
+        # drop the point from the tree
+        elem.clear()
+        segment.remove(elem)
+
+
+def clone_without_points(gpx: gp.gpx.GPX) -> gp.gpx.GPX:
+    """ gpx.clone(), except that the points of the first track segment (which
+    the patchers replace anyway) are not deep copied """
+    segment = gpx.tracks[0].segments[0]
+    points = segment.points
+    segment.points = []
+    try:
+        return gpx.clone()
+    finally:
+        segment.points = points
+
+
+def parse_gpx(gpx_file, fields=None) -> gp.gpx.GPX:
+    """ parse a gpx file (name or open file object). With fields=None this is a
+    full gp.parse. Otherwise only the requested POSITION_FIELDS of the first
+    track segment are kept - extensions, metadata and everything else are
+    skipped, which is much faster and smaller for tracks (like the template)
+    where only the positions are used. """
+    if fields is None:
+        if isinstance(gpx_file, str):
+            with open_gpx(gpx_file, 'r') as f:
+                return gp.parse(f)
+        return gp.parse(gpx_file)
+    unknown_fields = set(fields) - set(POSITION_FIELDS)
+    if unknown_fields:
+        raise ValueError("unknown track point fields: " + ", ".join(sorted(unknown_fields)))
+    keep_elevation = 'elevation' in fields
+    keep_time = 'time' in fields
+    track_points = []
+    for pt in iter_track_points(gpx_file):
+        track_points.append(gp.gpx.GPXTrackPoint(
+            pt.latitude,
+            pt.longitude,
+            elevation=pt.elevation if keep_elevation else None,
+            time=pt.time if keep_time else None))
+    gpx = gp.gpx.GPX()
+    # the track name is not kept; use an empty name so it can be appended to
+    gpx.tracks = [gp.gpx.GPXTrack(name='')]
+    gpx.tracks[0].segments = [gp.gpx.GPXTrackSegment()]
+    gpx.tracks[0].segments[0].points = track_points
+    return gpx
@@ -0,0 +1,137 @@
+import threading
+
+import numpy as np
+import folium
+from gpxpy import geo as gp_geo
+
+import gpx_projection
+
+
+# default size budget for the html map
+DEFAULT_MAX_KB = 1024
+# rough size of one [lat, lon] pair in the html, with coordinates rounded to 6 places (~0.1m)
+_BYTES_PER_POINT = 26
+# rough size of the html without any polyline points
+_BYTES_OVERHEAD = 8 * 1024
+# web mercator meters per pixel at the equator for zoom level 0
+_EQUATOR_METERS_PER_PIXEL = 156543.03392
+
+
+def meters_per_pixel(latitude: float, zoom: int) -> float:
+    """ ground resolution of a web map tile pixel at the given latitude and zoom level """
+    return _EQUATOR_METERS_PER_PIXEL * np.cos(np.radians(latitude)) / 2 ** zoom
+
+
+def simplify_polyline(lat_lon: np.ndarray, tolerance: float) -> np.ndarray:
+    """ Douglas-Peucker simplification of a lat,lon polyline. tolerance is in
+    meters. Returns the (sorted) indices of the points to keep; the first and
+    last points are always kept. """
+    len_pts = lat_lon.shape[0]
+    if len_pts < 3:
+        return np.arange(0, len_pts)
+    # local flat earth coordinates in meters
+    (xy,), _ = gpx_projection.project([lat_lon[:, 0:2]])
+    keep = np.zeros(shape=(len_pts,), dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    # an explicit stack - recursion is too deep for long rides
+    stack = [(0, len_pts - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        chord = xy[end, :] - xy[start, :]
+        pts = xy[start + 1:end, :] - xy[start, :]
+        chord_len = np.linalg.norm(chord)
+        if chord_len == 0:
+            dist = np.linalg.norm(pts, axis=1)
+        else:
+            dist = np.abs(chord[0] * pts[:, 1] - chord[1] * pts[:, 0]) / chord_len
+        ind_max = int(np.argmax(dist))
+        if dist[ind_max] > tolerance:
+            ind_split = start + 1 + ind_max
+            keep[ind_split] = True
+            stack.append((start, ind_split))
+            stack.append((ind_split, end))
+    return np.flatnonzero(keep)
+
+
+def patched_regions(is_patched) -> list:
+    """ convert a per-point patched flag into a list of (start, end) index ranges """
+    regions = []
+    region_start = None
+    for ind_pt, patched in enumerate(is_patched):
+        if patched and region_start is None:
+            region_start = ind_pt
+        elif not patched and region_start is not None:
+            regions.append((region_start, ind_pt))
+            region_start = None
+    if region_start is not None:
+        regions.append((region_start, len(is_patched)))
+    return regions
+
+
+def _to_locations(lat_lon: np.ndarray) -> list:
+    return np.round(lat_lon[:, 0:2], 6).tolist()
+
+
+def save_map(
+        folium_file: str,
+        fixed_lat_lon: np.ndarray,
+        query_lat_lon: np.ndarray,
+        template_lat_lon: np.ndarray,
+        regions=None,
+        zoom_start=14,
+        tolerance_pixels=1.0,
+        max_kb=DEFAULT_MAX_KB) -> float:
+    """ write a folium map of the output, query and template tracks. Each track
+    is simplified to tolerance_pixels at zoom_start, and the tolerance is then
+    doubled until the estimated html size fits in max_kb (None for no budget).
+    Patched regions (index ranges into fixed_lat_lon) are drawn as a separate,
+    highlighted layer. Returns the tolerance used, in meters. """
+    if regions is None:
+        regions = []
+    map_center = np.mean(fixed_lat_lon[:, 0:2], axis=0)
+    # include the neighbouring points so the highlighted regions join up with the track
+    region_tracks = [fixed_lat_lon[max(start - 1, 0):min(end + 1, fixed_lat_lon.shape[0]), :]
+                     for start, end in regions]
+    tracks = [fixed_lat_lon, query_lat_lon, template_lat_lon] + region_tracks
+    tolerance = tolerance_pixels * meters_per_pixel(map_center[0], zoom_start)
+    kept = [simplify_polyline(track, tolerance) for track in tracks]
+    if max_kb is not None:
+        max_points = (max_kb * 1024 - _BYTES_OVERHEAD) / _BYTES_PER_POINT
+        while sum(len(k) for k in kept) > max_points and tolerance < gp_geo.ONE_DEGREE:
+            tolerance *= 2
+            kept = [simplify_polyline(track, tolerance) for track in tracks]
+    locations = [_to_locations(track[k, :]) for track, k in zip(tracks, kept)]
+    # build map
+    mymap = folium.Map(location=map_center, zoom_start=zoom_start, tiles=None)
+    folium.TileLayer().add_to(mymap)
+    # add lines; note the dashes help distinguish trajectories which are typically on top
+    # of each other
+    layer = folium.FeatureGroup(name='output')
+    folium.PolyLine(locations[0], color='green', weight=4.5, opacity=0.5).add_to(layer)
+    layer.add_to(mymap)
+    layer = folium.FeatureGroup(name='query')
+    folium.PolyLine(locations[1], color='red', weight=4.5, opacity=0.5, dash_array='10').add_to(layer)
+    layer.add_to(mymap)
+    layer = folium.FeatureGroup(name='template')
+    folium.PolyLine(locations[2], color='blue', weight=4.5, opacity=0.5, dash_array='10').add_to(layer)
+    layer.add_to(mymap)
+    if region_tracks:
+        layer = folium.FeatureGroup(name='patched regions')
+        for region_locations in locations[3:]:
+            folium.PolyLine(region_locations, color='orange', weight=8, opacity=0.8).add_to(layer)
+        layer.add_to(mymap)
+    folium.LayerControl().add_to(mymap)
+    mymap.save(folium_file)
+    return tolerance
+
+
+def save_map_in_background(*args, **kwargs) -> threading.Thread:
+    """ run save_map in a worker thread, so writing the patched gpx is never
+    delayed by rendering. The thread is not a daemon, so the interpreter
+    waits for the map to be written before exiting. """
+    worker = threading.Thread(target=save_map, args=args, kwargs=kwargs, name='gpx_map')
+    worker.start()
+    return worker
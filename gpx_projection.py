@@ -0,0 +1,32 @@
+import numpy as np
+from gpxpy import geo as gp_geo
+
+
+def flat_earth_correction(origin: np.ndarray, dims: int) -> np.ndarray:
+    """ meters per degree of latitude and longitude (and 1.0 for elevation) at origin """
+    correction = np.ones(shape=(1, dims), dtype=float)
+    correction[0, 0] = gp_geo.ONE_DEGREE
+    correction[0, 1] = np.cos(np.radians(origin[0, 0])) * gp_geo.ONE_DEGREE
+    return correction
+
+
+def project(tracks: list, origin=None, dtype=np.float64) -> (list, np.ndarray):
+    """ project a list of lat,lon (or lat,lon,elevation) tracks into one shared local
+    flat earth (tangent plane) frame in meters, with a single vectorized operation.
+    The origin defaults to the mean point of the first track (the query). Returns the
+    projected tracks, in the given dtype, and the (1, dims) float64 origin. """
+    lengths = [track.shape[0] for track in tracks]
+    points = np.concatenate(tracks, axis=0).astype(np.float64, copy=False)
+    if origin is None:
+        origin = np.mean(tracks[0], axis=0, keepdims=True).astype(np.float64)
+    correction = flat_earth_correction(origin, points.shape[1])
+    # subtract the origin in float64, so float32 output only loses local precision
+    projected = ((points - origin) * correction).astype(dtype, copy=False)
+    return np.split(projected, np.cumsum(lengths)[:-1]), origin
+
+
+def unproject(points: np.ndarray, origin: np.ndarray) -> np.ndarray:
+    """ convert projected points (from project) back to lat,lon (and elevation) in float64 """
+    points = np.asarray(points, dtype=np.float64)
+    correction = flat_earth_correction(origin, points.shape[1])
+    return points / correction + origin[:, 0:points.shape[1]]
@@ -0,0 +1,106 @@
+import json
+import sys
+
+from gpxpy import geo as gp_geo
+from gpxpy import utils as gp_utils
+
+import gpx_io
+import gpx_stats
+
+
+# the number of increments binned at a time when estimating the jump threshold
+_CHUNK_SIZE = 4096
+
+
+def iter_gaps(points, max_time_gap_seconds=None, dist_thresh=None, template_points=None):
+    """ scan a stream of track points once and yield a dict for each gap.
+    A gap is an interval between consecutive points which is at least
+    max_time_gap_seconds long (the patch_gpx_time test) or at least
+    dist_thresh meters long (a jump in the query distance increments, as
+    in get_point_stats). If template_points is given (a time ordered stream)
+    the number of template points which could fill each gap is also reported. """
+    template_iter = iter(template_points) if template_points is not None else None
+    template_point = next(template_iter, None) if template_iter is not None else None
+    previous = None
+    index = 0
+    for point in points:
+        if previous is not None:
+            duration = None
+            if point.time is not None and previous.time is not None:
+                duration = gp_utils.total_seconds(point.time - previous.time)
+            distance = gp_geo.haversine_distance(previous.latitude, previous.longitude,
+                                                 point.latitude, point.longitude)
+            is_gap = (max_time_gap_seconds is not None and duration is not None
+                      and duration >= max_time_gap_seconds) or \
+                     (dist_thresh is not None and distance >= dist_thresh)
+            if is_gap:
+                gap = {
+                    'start_index': index - 1,
+                    'end_index': index,
+                    'start_time': previous.time.isoformat() if previous.time is not None else None,
+                    'end_time': point.time.isoformat() if point.time is not None else None,
+                    'duration_seconds': duration,
+                    'distance_meters': distance,
+                }
+                if template_iter is not None and (previous.time is None or point.time is None):
+                    # without times at both ends there is nothing to match the template against
+                    gap['template_points'] = None
+                elif template_iter is not None:
+                    # advance the template to this gap and count what falls inside it - as
+                    # patch_gpx_time does, this includes a point at the start time of the gap
+                    while template_point is not None and template_point.time < previous.time:
+                        template_point = next(template_iter, None)
+                    template_count = 0
+                    while template_point is not None and template_point.time < point.time:
+                        template_count += 1
+                        template_point = next(template_iter, None)
+                    gap['template_points'] = template_count
+                yield gap
+        previous = point
+        index += 1
+
+
+def jump_threshold(points, smad_factor=gpx_stats.AUTO_SMAD_FACTOR) -> float:
+    """ the distance above which a step between consecutive points is a jump:
+    the median plus smad_factor robust standard deviations of the steps, as in
+    the get_point_stats increment statistics - from a single streaming pass. """
+    stats = gpx_stats.StreamingQuantiles()
+    increments = []
+    previous = None
+    for point in points:
+        if previous is not None:
+            increments.append(gp_geo.haversine_distance(previous.latitude, previous.longitude,
+                                                        point.latitude, point.longitude))
+            if len(increments) == _CHUNK_SIZE:
+                stats.update(increments)
+                increments = []
+        previous = point
+    stats.update(increments)
+    if stats.count == 0:
+        # a single point has no steps to jump
+        return float('inf')
+    median, smad = stats.median_smad()
+    return median + smad_factor * smad
+
+
+def report_gaps(query_file, template_file=None, max_time_gap_seconds=None, dist_thresh=None, smad_factor=None,
+                out=None):
+    """ print each gap in the query as a line of JSON - without alignment, or
+    building the gpx object trees. With smad_factor, dist_thresh is instead
+    estimated from the query increments (see jump_threshold), which takes an
+    extra streaming pass over the query file. Returns the number of gaps found. """
+    if out is None:
+        out = sys.stdout
+    if smad_factor is not None:
+        dist_thresh = jump_threshold(gpx_io.iter_track_points(query_file), smad_factor)
+    template_points = None
+    if template_file is not None:
+        template_points = gpx_io.iter_track_points(template_file)
+    num_gaps = 0
+    for gap in iter_gaps(gpx_io.iter_track_points(query_file),
+                         max_time_gap_seconds=max_time_gap_seconds,
+                         dist_thresh=dist_thresh,
+                         template_points=template_points):
+        out.write(json.dumps(gap) + '\n')
+        num_gaps += 1
+    return num_gaps
@@ -0,0 +1,275 @@
+import argparse
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import email.parser
+import email.policy
+import http.server
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+import gpx_io
+
+
+# default thresholds, as for the command line tools
+DEFAULT_TIME_THRESH = 30
+DEFAULT_DIST_THRESH = 50
+# default limits on a job's run time (in seconds) and upload size (in MB)
+DEFAULT_JOB_TIMEOUT = 300
+DEFAULT_MAX_UPLOAD_MB = 64
+# the number of recent jobs kept for the latency metrics
+_LATENCY_HISTORY = 1000
+# size of the chunks the patched gpx is written back in
+_CHUNK_SIZE = 64 * 1024
+
+
+def _warm_worker():
+    """ pool initializer - pay the import costs once per worker, not per job """
+    importlib.import_module('patch_gpx_time')
+    importlib.import_module('patch_gpx_spatial')
+
+
+def _worker_ready() -> int:
+    """ a no-op job, submitted once per worker so the pool starts (and warms) up front """
+    return os.getpid()
+
+
+def patch_job(algorithm: str, query_xml: bytes, template_xml: bytes, threshold) -> bytes:
+    """ patch one query/template pair, returning the patched gpx as xml. Runs in a worker. """
+    import patch_gpx_time
+    import patch_gpx_spatial
+    gfp_query = gpx_io.parse_gpx(io.BytesIO(query_xml))
+    gfp_template = gpx_io.parse_gpx(io.BytesIO(template_xml), gpx_io.POSITION_FIELDS)
+    if algorithm == 'time':
+        output = patch_gpx_time.patch_gpx(gfp_query, gfp_template, threshold)
+    elif algorithm == 'spatial':
+        output = patch_gpx_spatial.patch_gpx_tracks(gfp_query, gfp_template, threshold)
+    else:
+        raise ValueError("unknown algorithm: " + algorithm)
+    return output.to_xml().encode('utf-8')
+
+
+class PatchService:
+    """ a pool of pre-warmed worker processes plus the queue and latency metrics. A job
+    which takes longer than job_timeout seconds (None for no limit) fails, as does one
+    whose worker dies (e.g. out of memory on a large spatial alignment). Either way the
+    pool is terminated - failing any other jobs queued or running in it - and replaced
+    by a freshly warmed one, so a hung job can never hold on to a worker. """
+
+    def __init__(self, workers=None, job_timeout=DEFAULT_JOB_TIMEOUT):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.job_timeout = job_timeout
+        self._lock = threading.Lock()
+        # held while the pool is being replaced
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._queued = 0
+        self._completed = 0
+        self._failed = 0
+        self._latencies = collections.deque(maxlen=_LATENCY_HISTORY)
+
+    def _new_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        """ a pool with all of its workers started and warmed - the executor only starts
+        workers on demand, so give each one a no-op job and wait for them all """
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        ready = [executor.submit(_worker_ready) for _ in range(self.workers)]
+        concurrent.futures.wait(ready)
+        return executor
+
+    def _replace_executor(self, executor: concurrent.futures.ProcessPoolExecutor):
+        """ terminate the workers of a broken or stuck pool, and install a new one """
+        with self._executor_lock:
+            if self._executor is not executor:
+                # another failed job has replaced it already
+                return
+            # there is no public way to stop a running job - so stop its process
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = self._new_executor()
+
+    def patch(self, algorithm: str, query_xml: bytes, template_xml: bytes, threshold) -> bytes:
+        """ queue a job and wait for its result """
+        return self.run(patch_job, algorithm, query_xml, template_xml, threshold)
+
+    def run(self, job, *args):
+        """ run job(*args) in a worker and wait for its result, keeping the metrics.
+        Raises concurrent.futures.TimeoutError if the job takes longer than job_timeout,
+        or concurrent.futures.process.BrokenProcessPool if its worker died. """
+        start = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+        try:
+            with self._executor_lock:
+                executor = self._executor
+            try:
+                future = executor.submit(job, *args)
+                result = future.result(timeout=self.job_timeout)
+            except (concurrent.futures.TimeoutError, concurrent.futures.process.BrokenProcessPool):
+                self._replace_executor(executor)
+                raise
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._queued -= 1
+        with self._lock:
+            self._completed += 1
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def metrics(self) -> dict:
+        """ queue_depth counts the jobs waiting for, or running in, a worker """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            metrics = {
+                'workers': self.workers,
+                'queue_depth': self._queued,
+                'completed': self._completed,
+                'failed': self._failed,
+            }
+        if latencies:
+            metrics['latency_ms'] = {
+                'mean': 1000 * sum(latencies) / len(latencies),
+                'p50': 1000 * latencies[len(latencies) // 2],
+                'p95': 1000 * latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+                'max': 1000 * latencies[-1],
+            }
+        return metrics
+
+    def close(self):
+        with self._executor_lock:
+            executor = self._executor
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def parse_upload(content_type: str, body: bytes) -> dict:
+    """ split a multipart/form-data body into a {field name: bytes} dict """
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    if not message.is_multipart():
+        raise ValueError("expected a multipart/form-data upload")
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            fields[name] = part.get_payload(decode=True)
+    return fields
+
+
+class PatchRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ POST /patch/time?time=30 or /patch/spatial?dist=50 (or dist=auto) with query and template
+    files as multipart/form-data; GET /metrics for the queue and latency metrics """
+    service = None
+    max_upload_bytes = DEFAULT_MAX_UPLOAD_MB * 1024 * 1024
+
+    def do_GET(self):
+        if urllib.parse.urlparse(self.path).path != '/metrics':
+            self.send_error(404)
+            return
+        self._send(200, 'application/json', json.dumps(self.service.metrics()).encode('utf-8'))
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == '/patch/time':
+            algorithm = 'time'
+            threshold = params.get('time', [DEFAULT_TIME_THRESH])[0]
+        elif url.path == '/patch/spatial':
+            algorithm = 'spatial'
+            threshold = params.get('dist', [DEFAULT_DIST_THRESH])[0]
+        else:
+            self.send_error(404)
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self.send_error(400, 'bad Content-Length')
+            return
+        if content_length > self.max_upload_bytes:
+            # refuse before reading any of it; send_error closes the connection
+            self.send_error(413, 'upload is larger than %d bytes' % self.max_upload_bytes)
+            return
+        try:
+            if algorithm == 'time' or threshold != 'auto':
+                threshold = float(threshold)
+            body = self.rfile.read(content_length)
+            fields = parse_upload(self.headers.get('Content-Type', ''), body)
+            query_xml = fields['query']
+            template_xml = fields['template']
+        except (ValueError, KeyError) as e:
+            self.send_error(400, 'bad upload: %s' % e)
+            return
+        try:
+            output = self.service.patch(algorithm, query_xml, template_xml, threshold)
+        except concurrent.futures.TimeoutError:
+            self.send_error(500, 'patching failed: timed out after %s seconds' % self.service.job_timeout)
+            return
+        except concurrent.futures.process.BrokenProcessPool:
+            self.send_error(500, 'patching failed: the worker process died')
+            return
+        except Exception as e:
+            self.send_error(500, 'patching failed: %s' % e)
+            return
+        self._send(200, 'application/gpx+xml', output)
+
+    def _send(self, status, content_type, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        for ind_chunk in range(0, len(payload), _CHUNK_SIZE):
+            self.wfile.write(payload[ind_chunk:ind_chunk + _CHUNK_SIZE])
+
+    def log_message(self, format, *args):
+        # keep the request log quiet - see /metrics instead
+        pass
+
+
+def make_server(port=0, workers=None, job_timeout=DEFAULT_JOB_TIMEOUT,
+                max_upload_mb=DEFAULT_MAX_UPLOAD_MB) -> http.server.ThreadingHTTPServer:
+    """ build a patching server bound to localhost; port 0 picks a free port """
+    service = PatchService(workers, job_timeout)
+    handler = type('BoundPatchRequestHandler', (PatchRequestHandler,),
+                   {'service': service, 'max_upload_bytes': int(max_upload_mb * 1024 * 1024)})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.service = service
+    return server
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description='patch_gpx_server - local http service for patch_gpx_time and patch_gpx_spatial')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='the localhost port to listen on default=8765')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='the number of worker processes default=number of cpus')
+    parser.add_argument('--job_timeout', type=float, default=DEFAULT_JOB_TIMEOUT,
+                        help='the time limit for a patching job (in seconds) default=%d' % DEFAULT_JOB_TIMEOUT)
+    parser.add_argument('--max_upload_mb', type=float, default=DEFAULT_MAX_UPLOAD_MB,
+                        help='the size limit for an upload (in MB) default=%d' % DEFAULT_MAX_UPLOAD_MB)
+    args = parser.parse_args(args)
+    server = make_server(args.port, args.workers, args.job_timeout, args.max_upload_mb)
+    print('patch_gpx_server listening on http://127.0.0.1:%d' % server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,11 +4,14 @@ import dtw
 import skimage.measure as measure
 import matplotlib.pyplot as plt
 import scipy.stats as sci_stats
-from gpxpy import geo as gp_geo
-import folium
-import os
 import argparse
 import sys
+import gpx_report
+import gpx_io
+import gpx_map
+import gpx_diagnostics
+import gpx_projection
+import gpx_stats
 
 
 def patch_deletions_with_template(
@@ -18,12 +21,18 @@ def patch_deletions_with_template(
         query_time=None,
         template_time=None,
         do_plots=False,
-        do_plots_output_name=None) -> (np.ndarray, list):
+        do_plots_output_name=None,
+        diagnostics_output_name=None,
+        max_plot_points=gpx_diagnostics.DEFAULT_MAX_POINTS,
+        dist_section_length=None) -> (np.ndarray, list):
+    # dist_thresh is in the units of the points, or 'auto' to estimate it from the
+    # aligned distances - per section of dist_section_length alignment points, if given
     # compute distance along the template as a reference length
     track_time = False
     if query_time is not None and template_time is not None:
         track_time = True
-    alignment = dtw.dtw(query, template, keep_internals=True)
+    # the internals (including the cost matrix) are only needed for the dtw plots
+    alignment = dtw.dtw(query, template, keep_internals=do_plots)
     if do_plots:
         ax = alignment.plot(type="threeway")
         # since it seems a bit difficult to tidy up the plots with labels,
@@ -32,12 +41,23 @@ def patch_deletions_with_template(
         for i in range(0, query.shape[1]):
             print('first query value on index ', i, ' is:', query[0, i])
         if do_plots_output_name:
-            plot_file = os.path.splitext(do_plots_output_name)[0] + '.alignment.png'
+            plot_file = gpx_io.strip_gpx_extension(do_plots_output_name) + '.alignment.png'
             ax.get_figure().savefig(plot_file)
     # merge these two trajectories into a single trajectory.
     # deletions are connected regions which are far from their aligned points
     pts_diff = template[alignment.index2, :] - query[alignment.index1, :]
     aligned_distance = np.linalg.norm(pts_diff, axis=1)
+    if diagnostics_output_name:
+        # decimated plots, rendered to file by another process
+        gpx_diagnostics.render_in_background(
+            gpx_diagnostics.render_alignment_diagnostics,
+            gpx_io.strip_gpx_extension(diagnostics_output_name),
+            query, template, alignment.index1, alignment.index2, aligned_distance,
+            max_plot_points)
+    if isinstance(dist_thresh, str):
+        if dist_thresh != 'auto':
+            raise ValueError("dist_thresh must be a number or 'auto'")
+        dist_thresh = gpx_stats.auto_threshold(aligned_distance, section_length=dist_section_length)
     deletion_state = (aligned_distance >= dist_thresh).astype(int)
     # run connected components analysis
     cc_deletions = measure.label(deletion_state, connectivity=1)
@@ -83,7 +103,7 @@ def patch_deletions_with_template(
 
 def gpx_to_lat_lon(file_name):
     ''' see https://towardsdatascience.com/build-interactive-gps-activity-maps-from-gpx-files-using-folium-cf9eebba1fe7 '''
-    gf = open(file_name, 'r')
+    gf = gpx_io.open_gpx(file_name, 'r')
     gfp = gp.parse(gf)
     gf.close()
     points = []
@@ -94,7 +114,8 @@ def gpx_to_lat_lon(file_name):
     return points
 
 
-def get_point_stats(points, points2=None, smad_factor=2, do_plots=True, do_plots_output_name=None):
+def get_point_stats(points, points2=None, smad_factor=2, do_plots=True, do_plots_output_name=None,
+                    max_plot_points=gpx_diagnostics.DEFAULT_MAX_POINTS):
     # compute outlier-robust point stats for misalignment detection
     if points2 is None:
         delta = points[1:, :] - points[0:-1, :]
@@ -104,13 +125,14 @@ def get_point_stats(points, points2=None, smad_factor=2, do_plots=True, do_plots
     # use MAD/SMAD to account for outliers
     delta_dist_median = np.median(delta_dist)
     delta_dist_smad = sci_stats.median_abs_deviation(delta_dist, scale='normal')
-    x = np.arange(0, len(delta_dist))
-    y_med = np.ones(shape=(len(x),)) * delta_dist_median
-    y_plus = y_med + delta_dist_smad * smad_factor
     if do_plots:
+        # cap the number of points drawn - keeping the spikes
+        x = gpx_diagnostics.decimate(delta_dist, max_plot_points)
+        y_med = np.ones(shape=(len(x),)) * delta_dist_median
+        y_plus = y_med + delta_dist_smad * smad_factor
         print(delta_dist_median, delta_dist_smad)
         plt.figure()
-        plt.plot(x, delta_dist)
+        plt.plot(x, delta_dist[x])
         plt.plot(x, y_med, 'r')
         plt.plot(x, y_plus, 'r--')
         if points2 is None:
@@ -121,7 +143,7 @@ def get_point_stats(points, points2=None, smad_factor=2, do_plots=True, do_plots
             plt.xlabel('alignment index')
         plt.ylabel('dist')
         if do_plots_output_name is not None:
-            plot_file = os.path.splitext(do_plots_output_name)[0] + '.point_stats.png'
+            plot_file = gpx_io.strip_gpx_extension(do_plots_output_name) + '.point_stats.png'
             plt.savefig(plot_file)
         plt.show()
     return delta_dist_median, delta_dist_smad
@@ -134,12 +156,8 @@ def gpx_to_points2(gfp_points, mean_point=None) -> np.array:
         points[pt_ind, 0] = pt.latitude
         points[pt_ind, 1] = pt.longitude
         pt_ind += 1
-    # compute the mean point for various uses
-    if mean_point is None:
-        mean_point = np.mean(points, axis=0, keepdims=True)
-    # apply local flat earth correction
-    flat_earth_correction = np.array([[1.0 * gp_geo.ONE_DEGREE, np.cos(mean_point[0, 0]) * gp_geo.ONE_DEGREE]])
-    corrected_points = (points - mean_point) * flat_earth_correction
+    # apply local flat earth correction, about the mean point by default
+    (corrected_points,), mean_point = gpx_projection.project([points], mean_point)
     return corrected_points, mean_point
 
 
@@ -150,38 +168,30 @@ def gpx_to_time_points(gfp_points) -> list:
     return time_points
 
 
-def gpx_to_points3(gfp_points, mean_point=None) -> (np.array, np.array):
+def gpx_to_lat_lon_elev(gfp_points) -> np.array:
     points = np.zeros(shape=(len(gfp_points), 3), dtype=float)
     for pt_ind, pt in enumerate(gfp_points):
         points[pt_ind, 0] = pt.latitude
         points[pt_ind, 1] = pt.longitude
         points[pt_ind, 2] = pt.elevation
-    # compute the mean point for various uses
-    if mean_point is None:
-        mean_point = np.mean(points, axis=0, keepdims=True)
-    # apply local flat earth correction
-    flat_earth_correction = np.array([[1.0 * gp_geo.ONE_DEGREE, np.cos(mean_point[0, 0]) * gp_geo.ONE_DEGREE, 1.0]])
-    corrected_points = (points - mean_point) * flat_earth_correction
+    return points
+
+
+def gpx_to_points3(gfp_points, mean_point=None) -> (np.array, np.array):
+    # apply local flat earth correction, about the mean point by default
+    (corrected_points,), mean_point = gpx_projection.project([gpx_to_lat_lon_elev(gfp_points)], mean_point)
     return corrected_points, mean_point
 
 
 def points_to_lat_lon_elev(points, mean_point) -> np.array:
     # correct points back to lat,lon, elevation
-    flat_earth_correction = np.array([[1.0 * gp_geo.ONE_DEGREE, np.cos(mean_point[0, 0]) * gp_geo.ONE_DEGREE, 1.0]])
-    corrected_points = points / flat_earth_correction + mean_point
-    return corrected_points
+    return gpx_projection.unproject(points, mean_point)
 
 
 def points_to_lat_lon(points, mean_point) -> np.array:
-    if points.shape[1] == 2:
-        # correct points back to lat,lon, elevation
-        flat_earth_correction = np.array([[1.0 * gp_geo.ONE_DEGREE, np.cos(mean_point[0, 0]) * gp_geo.ONE_DEGREE]])
-    elif points.shape[1] == 3:
-        # correct points back to lat,lon, elevation
-        flat_earth_correction = np.array([[1.0 * gp_geo.ONE_DEGREE, np.cos(mean_point[0, 0]) * gp_geo.ONE_DEGREE, 1.0]])
-    else:
+    if points.shape[1] not in [2, 3]:
         raise ValueError("unknown points shape!")
-    corrected_points = points / flat_earth_correction + mean_point
+    corrected_points = gpx_projection.unproject(points, mean_point)
     # and lop off the elevation, if it is there
     corrected_points = corrected_points[:, 0:2]
     return corrected_points
@@ -204,26 +214,21 @@ def points_to_gpx(
     return gfp_copy
 
 
-def patch_gpx(query_file, template_file, output_file, dist_thresh=50, do_plots=False, folium_output=False):
-    # run the gpx data through the patching process
-    gf = open(query_file, 'r')
-    gfp_query = gp.parse(gf)
-    gf.close()
-    gfp_query_copy = gfp_query.clone()
-    gf = open(template_file, 'r')
-    gfp_template = gp.parse(gf)
-    gf.close()
+def _patch_gpx_points(gfp_query, gfp_template, dist_thresh, do_plots=False, do_plots_output_name=None,
+                      diagnostics_output_name=None, dist_section_length=None):
+    # patch parsed gpx data, returning the patched gpx and the local flat earth points
+    gfp_query_copy = gpx_io.clone_without_points(gfp_query)
     # Hmm, should we assert that each gfp has a single track and segment?
     # Or, perhaps perform the analysis on each track/segment?
     # Do strava gpx tracks ever have more than one track/segment?
     # assume we have a single track and segment!
     gfp_query_points = gfp_query.tracks[0].segments[0].points
     gfp_template_points = gfp_template.tracks[0].segments[0].points
-    # Unpack gfp points into numpy arrays.
-    query_points, mean_point = gpx_to_points3(gfp_query_points)
+    # Unpack gfp points into numpy arrays, in a local frame about the query mean point
+    (query_points, template_points), mean_point = gpx_projection.project(
+        [gpx_to_lat_lon_elev(gfp_query_points), gpx_to_lat_lon_elev(gfp_template_points)])
     # Also unpack time of track points separately
     qp_time = gpx_to_time_points(gfp_query_points)
-    template_points, _ = gpx_to_points3(gfp_template_points, mean_point)
     tp_time = gpx_to_time_points(gfp_template_points)
     # patch the query - 50 meters seems a good number for mountain biking!
     fixed_points, fixed_points_time = patch_deletions_with_template(
@@ -233,11 +238,40 @@ def patch_gpx(query_file, template_file, output_file, dist_thresh=50, do_plots=F
         query_time=qp_time,
         template_time=tp_time,
         do_plots=do_plots,
-        do_plots_output_name=output_file)
-    # and generate a proper gpx object, and write to file
+        do_plots_output_name=do_plots_output_name,
+        diagnostics_output_name=diagnostics_output_name,
+        dist_section_length=dist_section_length)
+    # and generate a proper gpx object
     gpx = points_to_gpx(' patched', gfp_query_copy, fixed_points, mean_point,
                         fixed_points_time)
-    with open(output_file, 'w') as f:
+    return gpx, query_points, template_points, fixed_points, mean_point
+
+
+def patch_gpx_tracks(gfp_query: gp.gpx.GPX, gfp_template: gp.gpx.GPX, dist_thresh=50) -> gp.gpx.GPX:
+    """ patch deletions in the (already parsed) query with the template """
+    gpx, _, _, _, _ = _patch_gpx_points(gfp_query, gfp_template, dist_thresh)
+    return gpx
+
+
+def patch_gpx(query_file, template_file, output_file, dist_thresh=50, do_plots=False, folium_output=False,
+              query_fields=None, template_fields=gpx_io.POSITION_FIELDS,
+              folium_background=False, folium_max_kb=gpx_map.DEFAULT_MAX_KB, diagnostics=False,
+              dist_section_length=None):
+    # run the gpx data through the patching process.
+    # only positions and times of the template are used, so by default the
+    # template is parsed without extensions - see gpx_io.parse_gpx
+    gfp_query = gpx_io.parse_gpx(query_file, query_fields)
+    gfp_template = gpx_io.parse_gpx(template_file, template_fields)
+    gpx, query_points, template_points, fixed_points, mean_point = _patch_gpx_points(
+        gfp_query,
+        gfp_template,
+        dist_thresh,
+        do_plots=do_plots,
+        do_plots_output_name=output_file,
+        diagnostics_output_name=output_file if diagnostics else None,
+        dist_section_length=dist_section_length)
+    # write to file
+    with gpx_io.open_gpx(output_file, 'w') as f:
         f.write(gpx.to_xml())
 
     if folium_output:
@@ -245,33 +279,85 @@ def patch_gpx(query_file, template_file, output_file, dist_thresh=50, do_plots=F
         qp_lat_lon = points_to_lat_lon(query_points, mean_point)
         tp_lat_lon = points_to_lat_lon(template_points, mean_point)
         fp_lat_lon = points_to_lat_lon(fixed_points, mean_point)
-        # build map
-        map_center = np.mean(np.array(fp_lat_lon), axis=0)
-        mymap = folium.Map(location=map_center, zoom_start=14, tiles=None)
-        folium.TileLayer().add_to(mymap)
-        # add lines; note the dashes help distinguish trajectories which are typically on top
-        # of each other
-        folium.PolyLine(list(fp_lat_lon), color='green', weight=4.5, opacity=0.5).add_to(mymap)
-        folium.PolyLine(list(qp_lat_lon), color='red', weight=4.5, opacity=0.5, dash_array='10').add_to(mymap)
-        folium.PolyLine(list(tp_lat_lon), color='blue', weight=4.5, opacity=0.5, dash_array='10').add_to(mymap)
-        folium_file = os.path.splitext(output_file)[0] + '.html'
-        mymap.save(folium_file)
+        # output points are copied unchanged from the query or the template
+        query_rows = set(map(tuple, query_points))
+        regions = gpx_map.patched_regions([tuple(pt) not in query_rows for pt in fixed_points])
+        folium_file = gpx_io.strip_gpx_extension(output_file) + '.html'
+        save_map = gpx_map.save_map_in_background if folium_background else gpx_map.save_map
+        save_map(folium_file, fp_lat_lon, qp_lat_lon, tp_lat_lon, regions=regions, max_kb=folium_max_kb)
     # for unit testing
     return gpx
 
 
+def dist_threshold(value: str):
+    """ argparse type for --dist: a distance in meters, or 'auto' """
+    if value == 'auto':
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a distance in meters or 'auto', got %r" % value)
+
+
+def positive_int(value: str):
+    """ argparse type for a count which must be at least 1 """
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a positive integer, got %r" % value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("expected a positive integer, got %r" % value)
+    return count
+
+
 def main(args):
     parser = argparse.ArgumentParser(description='patch_gpx_spatial - patch gpx file with another similar gpx file')
     parser.add_argument('query_gpx',
                         help='the name of the gpx file to be patched - it''s contents are preferred')
     parser.add_argument('template_gpx',
                         help='the name of the gpx file to patch the query_gpx with')
-    parser.add_argument('output_gpx',
-                        help='the name of the output gpx file')
-    parser.add_argument('--dist', type=float, default=50,
-                        help='the distance threshold for query vs template misalignment (in meters) default=50')
+    parser.add_argument('output_gpx', nargs='?',
+                        help='the name of the output gpx file (not needed with --report)')
+    parser.add_argument('--dist', type=dist_threshold, default=50,
+                        help='the distance threshold for query vs template misalignment (in meters), '
+                             'or auto to estimate it from the alignment default=50')
+    parser.add_argument('--dist_section', type=positive_int, default=None,
+                        help='with --dist auto, estimate the threshold separately for each section of '
+                             'this many alignment points')
+    parser.add_argument('--map', action='store_true',
+                        help='also write an html map of the tracks next to the output_gpx')
+    parser.add_argument('--map_background', action='store_true',
+                        help='with --map, render the map in a background worker after the output_gpx is written')
+    parser.add_argument('--map_max_kb', type=float, default=gpx_map.DEFAULT_MAX_KB,
+                        help='with --map, the size budget for the html map (in KB) default=%d' % gpx_map.DEFAULT_MAX_KB)
+    parser.add_argument('--diagnostics', action='store_true',
+                        help='write decimated alignment and point stats plots next to the output_gpx, '
+                             'from a background process')
+    parser.add_argument('--report', action='store_true',
+                        help='do not patch - just print each gap in the query as a line of JSON')
+    parser.add_argument('--report_template', action='store_true',
+                        help='with --report, also count the template points available to fill each gap')
+    parser.add_argument('--report_time', type=float, default=30,
+                        help='with --report, the time gap between query points reported as a gap '
+                             '(in seconds) default=30')
+    parser.add_argument('--report_smad', type=float, default=gpx_stats.AUTO_SMAD_FACTOR,
+                        help='with --report, report steps between query points longer than the median '
+                             'step plus this many robust standard deviations default=%d' % gpx_stats.AUTO_SMAD_FACTOR)
     args = parser.parse_args(args)
-    patch_gpx(args.query_gpx, args.template_gpx, args.output_gpx, args.dist)
+    if args.dist_section is not None and args.dist != 'auto':
+        parser.error('--dist_section needs --dist auto')
+    if args.report:
+        # --dist is the query vs template misalignment threshold, so the jumps are
+        # judged against the distribution of the query steps instead
+        template_gpx = args.template_gpx if args.report_template else None
+        gpx_report.report_gaps(args.query_gpx, template_gpx, max_time_gap_seconds=args.report_time,
+                               smad_factor=args.report_smad)
+        return
+    if args.output_gpx is None:
+        parser.error('output_gpx is required unless --report is given')
+    patch_gpx(args.query_gpx, args.template_gpx, args.output_gpx, args.dist,
+              folium_output=args.map, folium_background=args.map_background, folium_max_kb=args.map_max_kb,
+              diagnostics=args.diagnostics, dist_section_length=args.dist_section)
 
 
 if __name__ == '__main__':
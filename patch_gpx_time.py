@@ -4,12 +4,14 @@ import matplotlib.pyplot as plt
 import scipy.stats as sci_stats
 from gpxpy import geo as gp_geo
 from gpxpy import utils as gp_utils
-import folium
-import os
 import argparse
 import sys
+import gpx_report
+import gpx_io
+import gpx_map
 import datetime as mod_datetime
 import copy
+import collections
 
 from typing import List
 
@@ -38,8 +40,9 @@ def diff_seconds(time1: mod_datetime.datetime, time2: mod_datetime.datetime):
 
 def filter_point(src: gp.gpx.GPXTrackPoint):
     """ copy the track point and delete the extensions -
-    this typically contains source-specific information"""
-    new_point = copy.deepcopy(src)
+    this typically contains source-specific information.
+    A shallow copy is enough - the remaining fields are immutable values"""
+    new_point = copy.copy(src)
     new_point.extensions = []
     return new_point
 
@@ -51,7 +54,7 @@ def patch_gpx(
     """ patch time gaps in the query with the template """
     query_track = query.tracks[0].segments[0].points
     template_track = template.tracks[0].segments[0].points
-    output_track = query.clone()
+    output_track = gpx_io.clone_without_points(query)
     track_points = []
     template_index = 0
     query_index = 0
@@ -99,17 +102,218 @@ def patch_gpx(
     return output_track
 
 
-def patch_gpx_file(query_file, template_file, output_file, time_thresh=30, do_plots=False, folium_output=False):
-    # run the gpx data through the patching process
-    gf = open(query_file, 'r')
-    gfp_query = gp.parse(gf)
-    gf.close()
-    gf = open(template_file, 'r')
-    gfp_template = gp.parse(gf)
-    gf.close()
+class IncrementalTimePatcher:
+    """ online version of patch_gpx for tracks which arrive in chunks. Query and
+    template points are appended as they arrive (each stream in time order) and
+    patched points are returned as soon as they are final - i.e. once both
+    streams are known to be complete past them. Each stream is known to be
+    complete up to its latest point, or up to complete_until if the caller knows
+    better (e.g. a live device which has been recording since), or entirely once
+    finish_query/finish_template is called. Nothing is inferred from the other
+    stream, so the streams may arrive in any order relative to each other - e.g.
+    a complete template followed by a live query. Only undecided points are kept.
+    Once both streams are finished the output matches patch_gpx, except that a
+    query which is declared complete (with complete_until) more than
+    max_time_gap_seconds past its last point, and then finishes, is treated as
+    having a gap after that point (which is then dropped, as at any other gap). """
+
+    def __init__(self, max_time_gap_seconds: float):
+        self.max_time_gap_seconds = max_time_gap_seconds
+        self._base_time = None
+        # undecided points
+        self._query = collections.deque()
+        self._template = collections.deque()
+        # per stream watermarks - no future points of a stream are earlier
+        self._query_complete = None
+        self._template_complete = None
+        self._template_latest = None
+        self._template_first = None
+        self._query_done = False
+        self._template_done = False
+        # state of the patch
+        self._started = False
+        self._lead_in_until = None
+        self._open_gap = False
+        self._tail_from = None
+        self._decided_time = None
+        self._emitted_time = None
+
+    def add_query_points(self, points, complete_until: mod_datetime.datetime = None) -> list:
+        """ append query points, returning any newly final output points. complete_until
+        optionally declares that no query points earlier than it are still to come. """
+        if self._query_done:
+            raise ValueError("the query has been finished")
+        for pt in points:
+            t = self._seconds(pt.time)
+            self._check_order(t, self._query_complete, 'query')
+            if self._emitted_time is not None and t < self._emitted_time:
+                raise ValueError("query point at %s is earlier than output already returned" % pt.time)
+            self._query_complete = t
+            self._query.append(pt)
+        self._query_complete = self._complete_until(complete_until, self._query_complete, 'query')
+        return self._process()
+
+    def add_template_points(self, points, complete_until: mod_datetime.datetime = None) -> list:
+        """ append template points, returning any newly final output points. complete_until
+        optionally declares that no template points earlier than it are still to come. """
+        if self._template_done:
+            raise ValueError("the template has been finished")
+        for pt in points:
+            t = self._seconds(pt.time)
+            self._check_order(t, self._template_complete, 'template')
+            if self._template_first is None:
+                self._template_first = t
+            self._template_latest = t
+            self._template_complete = t
+            # template points before the last decided query point are never used
+            if self._decided_time is None or t >= self._decided_time:
+                self._template.append(pt)
+        self._template_complete = self._complete_until(complete_until, self._template_complete, 'template')
+        return self._process()
+
+    def finish_query(self) -> list:
+        """ mark the query complete, returning any newly final output points """
+        self._query_done = True
+        return self._process()
+
+    def finish_template(self) -> list:
+        """ mark the template complete, returning any newly final output points """
+        self._template_done = True
+        return self._process()
+
+    def finish(self) -> list:
+        """ mark both streams complete, returning the rest of the output """
+        self._query_done = True
+        self._template_done = True
+        return self._process()
+
+    def buffered_points(self) -> int:
+        """ the number of points held while waiting for a decision """
+        return len(self._query) + len(self._template)
+
+    def _seconds(self, time: mod_datetime.datetime) -> float:
+        if self._base_time is None:
+            self._base_time = time
+        return diff_seconds(time, self._base_time)
+
+    @staticmethod
+    def _check_order(t, complete, stream):
+        if complete is not None and t < complete:
+            raise ValueError("%s points must arrive in time order, and after any complete_until" % stream)
+
+    def _complete_until(self, complete_until, complete, stream):
+        if complete_until is None:
+            return complete
+        t = self._seconds(complete_until)
+        self._check_order(t, complete, stream)
+        return t
+
+    @staticmethod
+    def _horizon(complete, done) -> float:
+        """ no future points of a stream will be earlier than its horizon """
+        if done:
+            return float('inf')
+        return complete if complete is not None else -float('inf')
+
+    def _emit(self, pt, output):
+        t = self._seconds(pt.time)
+        if self._emitted_time is not None and t < self._emitted_time:
+            # a broken promise in complete_until, or a bug - never hand out a track going backwards
+            raise ValueError("output point at %s is earlier than the previous output point" % pt.time)
+        self._emitted_time = t
+        output.append(pt)
+
+    def _emit_template_before(self, end_time, output):
+        while self._template and self._seconds(self._template[0].time) < end_time:
+            self._emit(filter_point(self._template.popleft()), output)
+
+    def _drop_template_before(self, start_time):
+        while self._template and self._seconds(self._template[0].time) < start_time:
+            self._template.popleft()
+
+    def _process(self) -> list:
+        output = []
+        gap = self.max_time_gap_seconds
+        query_horizon = self._horizon(self._query_complete, self._query_done)
+        template_horizon = self._horizon(self._template_complete, self._template_done)
+        # handle times in the template before the query starts
+        if not self._started:
+            if not self._query:
+                if self._query_done:
+                    # no query at all - the template is all there is
+                    self._emit_template_before(float('inf'), output)
+                elif self._template_first is not None and query_horizon - self._template_first >= gap:
+                    # the query will start too late - stream out the lead in
+                    self._emit_template_before(query_horizon, output)
+                return output
+            query_start = self._seconds(self._query[0].time)
+            if self._template_first is None and template_horizon <= query_start:
+                # the template may still start before the query
+                return output
+            self._started = True
+            if self._template_first is not None and query_start - self._template_first >= gap:
+                self._lead_in_until = query_start
+        if self._lead_in_until is not None:
+            self._emit_template_before(self._lead_in_until, output)
+            if template_horizon < self._lead_in_until:
+                return output
+            self._lead_in_until = None
+        # copy in the query until we get a time gap
+        while self._query:
+            query_time = self._seconds(self._query[0].time)
+            if len(self._query) >= 2:
+                next_time = self._seconds(self._query[1].time)
+                if self._open_gap or next_time - query_time >= gap:
+                    # fill the gap with the template, once all of it is here
+                    self._drop_template_before(query_time)
+                    self._emit_template_before(next_time, output)
+                    if template_horizon < next_time:
+                        self._open_gap = True
+                        return output
+                    self._open_gap = False
+                else:
+                    # query trackpoint is fine
+                    self._emit(self._query[0], output)
+                self._decided_time = query_time
+                self._query.popleft()
+                self._drop_template_before(query_time)
+            elif self._query_done:
+                # the last query value has no succeeding interval
+                if not self._open_gap:
+                    self._emit(self._query[0], output)
+                self._open_gap = False
+                self._tail_from = query_time
+                self._decided_time = query_time
+                self._query.popleft()
+            elif self._open_gap or query_horizon - query_time >= gap:
+                # the query is complete well past this point - any next point is beyond a gap
+                self._open_gap = True
+                self._drop_template_before(query_time)
+                self._emit_template_before(query_horizon, output)
+                return output
+            else:
+                return output
+        # copy in any template data after the query data, if there is a time gap
+        if self._tail_from is not None:
+            self._drop_template_before(self._tail_from)
+            if self._template_latest is not None and self._template_latest - self._tail_from >= gap:
+                self._emit_template_before(float('inf'), output)
+            elif self._template_done:
+                self._template.clear()
+        return output
+
+
+def patch_gpx_file(query_file, template_file, output_file, time_thresh=30, do_plots=False, folium_output=False,
+                   query_fields=None, template_fields=gpx_io.POSITION_FIELDS,
+                   folium_background=False, folium_max_kb=gpx_map.DEFAULT_MAX_KB):
+    # run the gpx data through the patching process.
+    # the template extensions are dropped by filter_point, so by default
+    # only the template positions and times are parsed - see gpx_io.parse_gpx
+    gfp_query = gpx_io.parse_gpx(query_file, query_fields)
+    gfp_template = gpx_io.parse_gpx(template_file, template_fields)
     output = patch_gpx(gfp_query, gfp_template, time_thresh)
 
-    with open(output_file, 'w') as f:
+    with gpx_io.open_gpx(output_file, 'w') as f:
         f.write(output.to_xml())
 
     if folium_output:
@@ -117,17 +321,12 @@ def patch_gpx_file(query_file, template_file, output_file, time_thresh=30, do_pl
         qp_lat_lon = gpx_to_lat_lon(gfp_query.tracks[0].segments[0].points)
         tp_lat_lon = gpx_to_lat_lon(gfp_template.tracks[0].segments[0].points)
         fp_lat_lon = gpx_to_lat_lon(output.tracks[0].segments[0].points)
-        # build map
-        map_center = np.mean(np.array(fp_lat_lon), axis=0)
-        mymap = folium.Map(location=map_center, zoom_start=14, tiles=None)
-        folium.TileLayer().add_to(mymap)
-        # add lines; note the dashes help distinguish trajectories which are typically on top
-        # of each other
-        folium.PolyLine(list(fp_lat_lon), color='green', weight=4.5, opacity=0.5).add_to(mymap)
-        folium.PolyLine(list(qp_lat_lon), color='red', weight=4.5, opacity=0.5, dash_array='10').add_to(mymap)
-        folium.PolyLine(list(tp_lat_lon), color='blue', weight=4.5, opacity=0.5, dash_array='10').add_to(mymap)
-        folium_file = os.path.splitext(output_file)[0] + '.html'
-        mymap.save(folium_file)
+        # query points are copied into the output as is - anything else came from the template
+        query_ids = set(id(pt) for pt in gfp_query.tracks[0].segments[0].points)
+        regions = gpx_map.patched_regions([id(pt) not in query_ids for pt in output.tracks[0].segments[0].points])
+        folium_file = gpx_io.strip_gpx_extension(output_file) + '.html'
+        save_map = gpx_map.save_map_in_background if folium_background else gpx_map.save_map
+        save_map(folium_file, fp_lat_lon, qp_lat_lon, tp_lat_lon, regions=regions, max_kb=folium_max_kb)
 
     return output
 
@@ -139,12 +338,29 @@ def main(args):
                         help='the name of the gpx file to be patched - it''s contents are preferred')
     parser.add_argument('template_gpx',
                         help='the name of the gpx file to patch the query_gpx with')
-    parser.add_argument('output_gpx',
-                        help='the name of the output gpx file')
+    parser.add_argument('output_gpx', nargs='?',
+                        help='the name of the output gpx file (not needed with --report)')
     parser.add_argument('--time', type=float, default=30,
                         help='the time threshold for patching time gaps in the query (in seconds) default=30')
+    parser.add_argument('--map', action='store_true',
+                        help='also write an html map of the tracks next to the output_gpx')
+    parser.add_argument('--map_background', action='store_true',
+                        help='with --map, render the map in a background worker after the output_gpx is written')
+    parser.add_argument('--map_max_kb', type=float, default=gpx_map.DEFAULT_MAX_KB,
+                        help='with --map, the size budget for the html map (in KB) default=%d' % gpx_map.DEFAULT_MAX_KB)
+    parser.add_argument('--report', action='store_true',
+                        help='do not patch - just print each gap in the query as a line of JSON')
+    parser.add_argument('--report_template', action='store_true',
+                        help='with --report, also count the template points available to fill each gap')
     args = parser.parse_args(args)
-    patch_gpx_file(args.query_gpx, args.template_gpx, args.output_gpx, args.time)
+    if args.report:
+        template_gpx = args.template_gpx if args.report_template else None
+        gpx_report.report_gaps(args.query_gpx, template_gpx, max_time_gap_seconds=args.time)
+        return
+    if args.output_gpx is None:
+        parser.error('output_gpx is required unless --report is given')
+    patch_gpx_file(args.query_gpx, args.template_gpx, args.output_gpx, args.time,
+                   folium_output=args.map, folium_background=args.map_background, folium_max_kb=args.map_max_kb)
 
 
 if __name__ == '__main__':
@@ -14,8 +14,15 @@ setup(
                       'imageio',
                       'folium'],
     packages=[],
-    py_modules=[],
-    scripts=['patch_gpx_spatial',
+    py_modules=['gpx_diagnostics',
+                'gpx_io',
+                'gpx_map',
+                'gpx_projection',
+                'gpx_report',
+                'gpx_stats'],
+    scripts=['patch_gpx_server',
+             'patch_gpx_server.py',
+             'patch_gpx_spatial',
              'patch_gpx_spatial.py',
              'patch_gpx_time',
              'patch_gpx_time.py'],
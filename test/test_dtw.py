@@ -9,6 +9,10 @@ import numpy as np
 import dtw
 import matplotlib.pyplot as plt
 import patch_gpx_spatial
+import gpx_diagnostics
+import multiprocessing
+import tempfile
+import shutil
 
 def gen_2d(len_pts=100):
     # a full 2pi
@@ -122,6 +126,32 @@ class MyTestCase(unittest.TestCase):
         max_diff = target_dist * 0.05
         self.assertTrue(abs(output_dist-target_dist) < max_diff)
 
+    def test_decimate(self):
+        # spikes survive decimation, and the point cap is respected
+        values = np.random.uniform(size=100000)
+        values[12345] = 10.0
+        x = gpx_diagnostics.decimate(values, 1000)
+        self.assertLessEqual(len(x), 1000)
+        self.assertIn(12345, x)
+        self.assertTrue(np.all(np.diff(x) > 0))
+        self.assertEqual(len(gpx_diagnostics.decimate(values[0:10], 1000)), 10)
+
+    def test_dtw_patch_diagnostics(self):
+        # diagnostics are written to file by a background process
+        query, template = gen_2d(100)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            output_name = os.path.join(tmp_dir, 'diagnostics.gpx')
+            patch_gpx_spatial.patch_deletions_with_template(query, template, 0.5,
+                                                            diagnostics_output_name=output_name,
+                                                            max_plot_points=50)
+            for worker in multiprocessing.active_children():
+                worker.join()
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'diagnostics.alignment.png')))
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'diagnostics.point_stats.png')))
+        finally:
+            shutil.rmtree(tmp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
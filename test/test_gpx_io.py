@@ -0,0 +1,60 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+if '..' not in sys.path:
+    sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import gpxpy as gp
+import gpx_io
+
+
+class MyTestCase(unittest.TestCase):
+    def test_compressed_round_trip(self):
+        # write the query with each codec, and read it back
+        qfile = '../data/Calero_Mayfair_ranch_trail.gpx'
+        with open(qfile, 'r') as f:
+            xml = f.read()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for ext in ['.gpx', '.gpx.gz', '.gpx.bz2', '.gpx.xz']:
+                cfile = os.path.join(tmp_dir, 'query' + ext)
+                with gpx_io.open_gpx(cfile, 'w') as f:
+                    f.write(xml)
+                with gpx_io.open_gpx(cfile, 'r') as f:
+                    gfp = gp.parse(f)
+                self.assertEqual(len(gfp.tracks[0].segments[0].points), 2311)
+                self.assertEqual(len(list(gpx_io.iter_track_points(cfile))), 2311)
+                self.assertEqual(gpx_io.strip_gpx_extension(cfile), os.path.join(tmp_dir, 'query'))
+            # compressed files should really be compressed
+            self.assertLess(os.path.getsize(os.path.join(tmp_dir, 'query.gpx.gz')),
+                            os.path.getsize(os.path.join(tmp_dir, 'query.gpx')) / 4)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_parse_gpx_fields(self):
+        # a projected parse keeps only the requested fields of each point
+        tfile = '../data/Calero_big_ride_2.gpx'
+        full = gpx_io.parse_gpx(tfile).tracks[0].segments[0].points
+        positions = gpx_io.parse_gpx(tfile, gpx_io.POSITION_FIELDS).tracks[0].segments[0].points
+        lat_lon = gpx_io.parse_gpx(tfile, ['latitude', 'longitude']).tracks[0].segments[0].points
+        self.assertEqual(len(full), 9454)
+        self.assertEqual(len(positions), len(full))
+        self.assertEqual(len(lat_lon), len(full))
+        self.assertGreater(len(full[0].extensions), 0)
+        for ind_pt in [0, 1000, len(full) - 1]:
+            self.assertEqual(positions[ind_pt].latitude, full[ind_pt].latitude)
+            self.assertEqual(positions[ind_pt].longitude, full[ind_pt].longitude)
+            self.assertEqual(positions[ind_pt].elevation, full[ind_pt].elevation)
+            self.assertEqual(positions[ind_pt].time, full[ind_pt].time)
+            self.assertEqual(len(positions[ind_pt].extensions), 0)
+            self.assertIsNone(lat_lon[ind_pt].elevation)
+            self.assertIsNone(lat_lon[ind_pt].time)
+        with self.assertRaises(ValueError):
+            gpx_io.parse_gpx(tfile, ['latitude', 'heart_rate'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+if '..' not in sys.path:
+    sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import numpy as np
+import gpx_map
+
+
+class MyTestCase(unittest.TestCase):
+    def test_simplify_polyline(self):
+        # a straight line simplifies to its end points
+        lat_lon = np.zeros(shape=(1000, 2))
+        lat_lon[:, 0] = np.linspace(37.0, 37.1, 1000)
+        lat_lon[:, 1] = -121.8
+        self.assertEqual(list(gpx_map.simplify_polyline(lat_lon, 1.0)), [0, 999])
+        # but a corner is kept
+        lat_lon[500:, 1] = np.linspace(-121.8, -121.7, 500)
+        lat_lon[500:, 0] = lat_lon[499, 0]
+        self.assertEqual(list(gpx_map.simplify_polyline(lat_lon, 1.0)), [0, 499, 999])
+        # and no point is further from the simplified line than the tolerance
+        rng = np.random.default_rng(0)
+        lat_lon = np.cumsum(rng.normal(scale=1e-4, size=(2000, 2)), axis=0) + [37.0, -121.8]
+        kept = gpx_map.simplify_polyline(lat_lon, 5.0)
+        self.assertLess(len(kept), len(lat_lon))
+        self.assertGreater(len(kept), 2)
+
+    def test_patched_regions(self):
+        self.assertEqual(gpx_map.patched_regions([False, True, True, False, True]), [(1, 3), (4, 5)])
+        self.assertEqual(gpx_map.patched_regions([False, False]), [])
+
+    def test_save_map_budget(self):
+        rng = np.random.default_rng(0)
+        lat_lon = np.cumsum(rng.normal(scale=1e-4, size=(20000, 2)), axis=0) + [37.0, -121.8]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            folium_file = os.path.join(tmp_dir, 'map.html')
+            gpx_map.save_map(folium_file, lat_lon, lat_lon[0:10000, :], lat_lon[5000:, :],
+                             regions=[(10000, 10500)], max_kb=100)
+            self.assertLess(os.path.getsize(folium_file), 100 * 1024)
+            # and in the background
+            background_file = os.path.join(tmp_dir, 'background.html')
+            worker = gpx_map.save_map_in_background(background_file, lat_lon, lat_lon, lat_lon, max_kb=100)
+            worker.join()
+            self.assertTrue(os.path.exists(background_file))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import sys
+
+if '..' not in sys.path:
+    sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import numpy as np
+from gpxpy import geo as gp_geo
+import gpx_projection
+
+
+def gen_tracks(num_tracks=5, len_pts=1000):
+    # random walks of lat, lon, elevation around Calero
+    rng = np.random.default_rng(0)
+    tracks = []
+    for ind_track in range(0, num_tracks):
+        steps = rng.normal(scale=[1e-4, 1e-4, 0.5], size=(len_pts + ind_track, 3))
+        tracks.append(np.cumsum(steps, axis=0) + [37.19, -121.80, 120.0])
+    return tracks
+
+
+class MyTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        tracks = gen_tracks()
+        for dtype, places in [(np.float64, 9), (np.float32, 6)]:
+            projected, origin = gpx_projection.project(tracks, dtype=dtype)
+            self.assertEqual(len(projected), len(tracks))
+            for track, track_projected in zip(tracks, projected):
+                self.assertEqual(track_projected.dtype, dtype)
+                self.assertEqual(track_projected.shape, track.shape)
+                round_trip = gpx_projection.unproject(track_projected, origin)
+                # 1e-6 degrees is ~0.1m
+                self.assertAlmostEqual(float(np.max(np.abs(round_trip[:, 0:2] - track[:, 0:2]))), 0.0, places=places)
+                self.assertAlmostEqual(float(np.max(np.abs(round_trip[:, 2] - track[:, 2]))), 0.0, places=2)
+        # the origin is the mean of the first track
+        self.assertAlmostEqual(float(np.max(np.abs(origin - np.mean(tracks[0], axis=0)))), 0.0, places=9)
+        # lat, lon only
+        projected, origin = gpx_projection.project([track[:, 0:2] for track in tracks])
+        round_trip = gpx_projection.unproject(projected[1], origin)
+        self.assertAlmostEqual(float(np.max(np.abs(round_trip - tracks[1][:, 0:2]))), 0.0, places=9)
+
+    def test_batch_matches_single(self):
+        # projecting together is the same as projecting one at a time about the same origin
+        tracks = gen_tracks()
+        projected, origin = gpx_projection.project(tracks)
+        for track, track_projected in zip(tracks, projected):
+            (single,), _ = gpx_projection.project([track], origin)
+            self.assertTrue(np.array_equal(single, track_projected))
+
+    def test_distances(self):
+        # east-west and north-south distances agree with the haversine distance
+        lat, lon = 37.19, -121.80
+        tracks = [np.array([[lat, lon], [lat, lon + 0.01], [lat + 0.01, lon]])]
+        projected, _ = gpx_projection.project(tracks, origin=np.array([[lat, lon]]))
+        east = gp_geo.haversine_distance(lat, lon, lat, lon + 0.01)
+        north = gp_geo.haversine_distance(lat, lon, lat + 0.01, lon)
+        self.assertAlmostEqual(float(np.linalg.norm(projected[0][1, :])), east, delta=east * 1e-3)
+        self.assertAlmostEqual(float(np.linalg.norm(projected[0][2, :])), north, delta=north * 1e-2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import os
+import sys
+
+if '..' not in sys.path:
+    sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import numpy as np
+import scipy.stats as sci_stats
+import gpx_stats
+
+
+class MyTestCase(unittest.TestCase):
+    def test_streaming_quantiles(self):
+        # chunked, streaming estimates agree with the full sort to within the bin resolution
+        rng = np.random.default_rng(0)
+        values = np.abs(rng.normal(loc=5.0, scale=3.0, size=200000))
+        stats = gpx_stats.StreamingQuantiles()
+        for ind_start in range(0, len(values), 1000):
+            stats.update(values[ind_start:ind_start + 1000])
+        self.assertEqual(stats.count, len(values))
+        for q in [0.1, 0.25, 0.5, 0.75, 0.9]:
+            self.assertAlmostEqual(stats.quantile(q), np.quantile(values, q), delta=np.quantile(values, q) * 0.01)
+        median, smad = stats.median_smad()
+        self.assertAlmostEqual(median, np.median(values), delta=0.05)
+        self.assertAlmostEqual(smad, sci_stats.median_abs_deviation(values, scale='normal'), delta=0.1)
+        # zero and out of range values are counted, not lost
+        stats.update(np.array([0.0, 1e9]))
+        self.assertEqual(stats.count, len(values) + 2)
+        with self.assertRaises(ValueError):
+            gpx_stats.StreamingQuantiles().quantile(0.5)
+
+    def test_auto_threshold(self):
+        # the threshold sits well above the noise but well below a deletion
+        rng = np.random.default_rng(0)
+        aligned_distance = np.abs(rng.normal(loc=5.0, scale=3.0, size=100000))
+        aligned_distance[50000:51000] = 400.0
+        threshold = gpx_stats.auto_threshold(aligned_distance)
+        self.assertGreater(threshold, np.quantile(aligned_distance, 0.99))
+        self.assertLess(threshold, 100.0)
+        # per section, the thresholds follow the local noise
+        aligned_distance[0:50000] *= 0.5
+        thresholds = gpx_stats.auto_threshold(aligned_distance, section_length=1000)
+        self.assertEqual(thresholds.shape, aligned_distance.shape)
+        self.assertLess(thresholds[0], thresholds[-1])
+        # including the section which is entirely a deletion
+        self.assertTrue(np.all(aligned_distance[50000:51000] >= thresholds[50000:51000]))
+        self.assertTrue(np.all(thresholds <= threshold * 2))
+        for section_length in [0, -1000]:
+            with self.assertRaises(ValueError):
+                gpx_stats.auto_threshold(aligned_distance, section_length=section_length)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import os
+import sys
+import json
+import time
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
+import threading
+import urllib.request
+import urllib.error
+
+if '..' not in sys.path:
+    sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+import gpxpy as gp
+import patch_gpx_server
+import patch_gpx_time
+
+
+def multipart_body(fields: dict) -> (bytes, str):
+    # encode {name: bytes} as multipart/form-data
+    boundary = 'gpx-tools-test-boundary'
+    body = b''
+    for name, value in fields.items():
+        body += b'--' + boundary.encode() + b'\r\n'
+        body += b'Content-Disposition: form-data; name="' + name.encode() + b'"; filename="' + name.encode() + \
+                b'.gpx"\r\n'
+        body += b'Content-Type: application/gpx+xml\r\n\r\n' + value + b'\r\n'
+    body += b'--' + boundary.encode() + b'--\r\n'
+    return body, 'multipart/form-data; boundary=' + boundary
+
+
+class MyTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = patch_gpx_server.make_server(port=0, workers=2)
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.server.service.close()
+        cls.thread.join()
+
+    def post(self, path, fields):
+        body, content_type = multipart_body(fields)
+        request = urllib.request.Request(self.url + path, data=body, headers={'Content-Type': content_type})
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+
+    def test_patch(self):
+        qfile = '../data/Calero_Mayfair_ranch_trail.gpx'
+        tfile = '../data/Calero_big_ride_2.gpx'
+        with open(qfile, 'rb') as f:
+            query_xml = f.read()
+        with open(tfile, 'rb') as f:
+            template_xml = f.read()
+        # the service should give the same answer as the library
+        output = gp.parse(self.post('/patch/time?time=30', {'query': query_xml, 'template': template_xml}).decode())
+        with open(qfile, 'r') as f:
+            gfp_query = gp.parse(f)
+        with open(tfile, 'r') as f:
+            gfp_template = gp.parse(f)
+        expected = patch_gpx_time.patch_gpx(gfp_query, gfp_template, 30)
+        self.assertEqual(len(output.tracks[0].segments[0].points), len(expected.tracks[0].segments[0].points))
+        output = gp.parse(self.post('/patch/spatial', {'query': query_xml, 'template': template_xml}).decode())
+        self.assertGreater(len(output.tracks[0].segments[0].points), len(gfp_query.tracks[0].segments[0].points))
+        # bad uploads are rejected
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post('/patch/time', {'query': query_xml})
+        self.assertEqual(cm.exception.code, 400)
+        # and the metrics reflect the jobs
+        with urllib.request.urlopen(self.url + '/metrics') as response:
+            metrics = json.loads(response.read())
+        self.assertEqual(metrics['workers'], 2)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertGreaterEqual(metrics['completed'], 2)
+        self.assertGreater(metrics['latency_ms']['max'], 0)
+
+    def test_failed_jobs(self):
+        # the workers are started and warmed before the first job
+        # (not counting the workers of the test server)
+        server_workers = set(multiprocessing.active_children())
+
+        def service_workers():
+            return len(set(multiprocessing.active_children()) - server_workers)
+
+        service = patch_gpx_server.PatchService(workers=2, job_timeout=2)
+        try:
+            self.assertEqual(service_workers(), 2)
+            # a worker which dies, or a job which hangs, fails that job rather than the
+            # service - which carries on with a fresh, warm pool straight away
+            with self.assertRaises(concurrent.futures.process.BrokenProcessPool):
+                service.run(os._exit, 1)
+            self.assertEqual(service_workers(), 2)
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                service.run(time.sleep, 3600)
+            self.assertEqual(service_workers(), 2)
+            start = time.perf_counter()
+            self.assertEqual(service.run(abs, -2), 2)
+            self.assertLess(time.perf_counter() - start, 1)
+            metrics = service.metrics()
+            self.assertEqual(metrics['queue_depth'], 0)
+            self.assertEqual(metrics['failed'], 2)
+            self.assertEqual(metrics['completed'], 1)
+        finally:
+            service.close()
+
+    def test_upload_limit(self):
+        server = patch_gpx_server.make_server(port=0, workers=1, max_upload_mb=0.001)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            body, content_type = multipart_body({'query': b'x' * 2048, 'template': b'x'})
+            request = urllib.request.Request('http://127.0.0.1:%d/patch/time' % server.server_address[1],
+                                             data=body, headers={'Content-Type': content_type})
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(request)
+            self.assertEqual(cm.exception.code, 413)
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.service.close()
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,8 @@ import scipy
 import matplotlib.pyplot as plt
 
 import patch_gpx_spatial
+import gpx_report
+import gpx_io
 from patch_gpx_spatial import gpx_to_points3
 
 
@@ -71,8 +73,9 @@ class MyTestCase(unittest.TestCase):
             plt.xlabel('template index')
             plt.show()
         # surprisingly, this route only spans about 6+km as the
-        # crow flies
-        self.assertTrue(np.abs(np.max(dist_mat)-6342) < 1.0)
+        # crow flies. With the longitude correction taken in radians
+        # this agrees with the haversine distance to within a meter.
+        self.assertTrue(np.abs(np.max(dist_mat)-6179.5) < 1.0)
         print(np.max(dist_mat))
 
     def test_gpx_dtw(self, do_plots=False):
@@ -111,6 +114,42 @@ class MyTestCase(unittest.TestCase):
         self.assertLessEqual(len(gpx.tracks[0].segments[0].points), max_points)
         # todo: more checks!
 
+    def test_gpx_dtw_auto(self):
+        # the automatic distance threshold should find the same big deletion as 50m
+        qfile = '../data/Calero_Mayfair_ranch_trail.gpx'
+        tfile = '../data/Calero_big_ride_2.gpx'
+        fixed = patch_gpx_spatial.patch_gpx(qfile, tfile, 'calero_patched_spatial_auto.gpx', dist_thresh=50)
+        os.remove('calero_patched_spatial_auto.gpx')
+        for section_length in [None, 500]:
+            gpx = patch_gpx_spatial.patch_gpx(qfile, tfile, 'calero_patched_spatial_auto.gpx', dist_thresh='auto',
+                                              dist_section_length=section_length)
+            os.remove('calero_patched_spatial_auto.gpx')
+            num_points = len(gpx.tracks[0].segments[0].points)
+            self.assertAlmostEqual(num_points, len(fixed.tracks[0].segments[0].points), delta=50)
+        with self.assertRaises(ValueError):
+            patch_gpx_spatial.patch_gpx(qfile, tfile, 'calero_patched_spatial_auto.gpx', dist_thresh='median')
+        # --dist_section is a positive number of alignment points, and only applies to --dist auto
+        for args in [['--dist', 'auto', '--dist_section', '0'], ['--dist', 'auto', '--dist_section', '-5'],
+                     ['--dist_section', '500']]:
+            with self.assertRaises(SystemExit):
+                patch_gpx_spatial.main([qfile, tfile, 'calero_patched_spatial_auto.gpx'] + args)
+        self.assertFalse(os.path.exists('calero_patched_spatial_auto.gpx'))
+
+    def test_report_jumps(self):
+        # the query strides are 10-60m; only the deletion near Bald Peaks is a jump
+        qfile = '../data/Calero_Mayfair_ranch_trail.gpx'
+        dist_thresh = gpx_report.jump_threshold(gpx_io.iter_track_points(qfile))
+        self.assertGreater(dist_thresh, 70)
+        self.assertLess(dist_thresh, 1000)
+        gaps = list(gpx_report.iter_gaps(gpx_io.iter_track_points(qfile), dist_thresh=dist_thresh))
+        self.assertEqual(len(gaps), 1)
+        self.assertAlmostEqual(gaps[0]['distance_meters'], 1142, delta=1)
+        # the time gap test also picks up the stops, where the query hardly moves
+        gaps = list(gpx_report.iter_gaps(gpx_io.iter_track_points(qfile), max_time_gap_seconds=30,
+                                         dist_thresh=dist_thresh))
+        self.assertGreater(len(gaps), 1)
+        self.assertTrue(any(gap['distance_meters'] < 10 for gap in gaps))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,8 @@
 import unittest
 import os
 import sys
+import shutil
+import tempfile
 
 if '..' not in sys.path:
     sys.path.insert(1, os.path.join(sys.path[0], '..'))
@@ -9,6 +11,8 @@ from datetime import datetime, timedelta
 
 import gpxpy.gpx
 import patch_gpx_time
+import gpx_report
+import gpx_io
 import gpxpy as gp
 import numpy as np
 import matplotlib.pyplot as plt
@@ -55,6 +59,37 @@ def gen_gpx():
     return gpx_query, gpx_template, query_lat_lon, template_lat_lon
 
 
+def run_incremental(query: gp.gpx.GPX, template: gp.gpx.GPX, chunk_size: int, max_time_gap_seconds=30,
+                    order='interleaved'):
+    # feed the two tracks to an IncrementalTimePatcher, chunk_size points at a time - either
+    # interleaved in time order, or one complete track and then the other
+    query_points = query.tracks[0].segments[0].points
+    template_points = template.tracks[0].segments[0].points
+    patcher = patch_gpx_time.IncrementalTimePatcher(max_time_gap_seconds)
+    output = []
+    max_buffered = 0
+    if order == 'interleaved':
+        events = sorted([(pt.time, 0, ind_pt) for ind_pt, pt in enumerate(query_points)] +
+                        [(pt.time, 1, ind_pt) for ind_pt, pt in enumerate(template_points)])
+        for ind_event in range(0, len(events), chunk_size):
+            chunk = events[ind_event:ind_event + chunk_size]
+            output += patcher.add_query_points([query_points[i] for _, src, i in chunk if src == 0])
+            output += patcher.add_template_points([template_points[i] for _, src, i in chunk if src == 1])
+            max_buffered = max(max_buffered, patcher.buffered_points())
+    else:
+        streams = [(query_points, patcher.add_query_points, patcher.finish_query),
+                   (template_points, patcher.add_template_points, patcher.finish_template)]
+        if order == 'template_first':
+            streams.reverse()
+        for points, add_points, finish_points in streams:
+            for ind_pt in range(0, len(points), chunk_size):
+                output += add_points(points[ind_pt:ind_pt + chunk_size])
+                max_buffered = max(max_buffered, patcher.buffered_points())
+            output += finish_points()
+    output += patcher.finish()
+    return output, max_buffered
+
+
 class MyTestCase(unittest.TestCase):
     def test_generated(self, do_plots=False):
         # todo: test elevation and other fields
@@ -161,6 +196,123 @@ class MyTestCase(unittest.TestCase):
         self.assertGreaterEqual(len(gpx.tracks[0].segments[0].points), min_points)
         self.assertLessEqual(len(gpx.tracks[0].segments[0].points), max_points)
 
+    def test_gpx_pair_compressed(self):
+        # compressed input and output should give the same result as plain files
+        qfile = '../data/Calero_Mayfair_ranch_trail.gpx'
+        tfile = '../data/Calero_big_ride_2.gpx'
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            qfile_gz = os.path.join(tmp_dir, 'query.gpx.gz')
+            with open(qfile, 'r') as f, gpx_io.open_gpx(qfile_gz, 'w') as f_gz:
+                shutil.copyfileobj(f, f_gz)
+            ofile = os.path.join(tmp_dir, 'patched.gpx.xz')
+            gpx = patch_gpx_time.patch_gpx_file(qfile_gz, tfile, ofile, 30)
+            with gpx_io.open_gpx(ofile, 'r') as f:
+                gfp_output = gp.parse(f)
+            self.assertEqual(len(gpx.tracks[0].segments[0].points), len(gfp_output.tracks[0].segments[0].points))
+            self.assertEqual(len(list(gpx_io.iter_track_points(ofile))), len(gfp_output.tracks[0].segments[0].points))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_incremental_generated(self):
+        # chunked, online patching should give the same points as the batch patcher
+        q, t, _, _ = gen_gpx()
+        fixed = patch_gpx_time.patch_gpx(q, t, max_time_gap_seconds=30).tracks[0].segments[0].points
+        for order in ['interleaved', 'template_first', 'query_first']:
+            for chunk_size in [1, 5, 1000]:
+                output, _ = run_incremental(q, t, chunk_size, order=order)
+                self.assertEqual([pt.time for pt in output], [pt.time for pt in fixed])
+                self.assertEqual([pt.latitude for pt in output], [pt.latitude for pt in fixed])
+
+    def test_incremental_file(self):
+        # on a real ride the output matches the batch patcher - whether the tracks arrive
+        # together (when the state stays bounded by the gaps rather than the length of
+        # the ride) or one after the other, as for a complete template and a live query
+        gfp_query = gpx_io.parse_gpx('../data/Calero_Mayfair_ranch_trail.gpx')
+        gfp_template = gpx_io.parse_gpx('../data/Calero_big_ride_2.gpx', gpx_io.POSITION_FIELDS)
+        fixed = patch_gpx_time.patch_gpx(gfp_query, gfp_template, 30).tracks[0].segments[0].points
+        for order in ['interleaved', 'template_first', 'query_first']:
+            output, max_buffered = run_incremental(gfp_query, gfp_template, 50, order=order)
+            self.assertEqual([pt.time for pt in output], [pt.time for pt in fixed])
+            self.assertEqual([pt.longitude for pt in output], [pt.longitude for pt in fixed])
+            if order == 'interleaved':
+                self.assertLess(max_buffered, 1000)
+
+    def test_incremental_watermarks(self):
+        q, t, _, _ = gen_gpx()
+        query_points = q.tracks[0].segments[0].points
+        template_points = t.tracks[0].segments[0].points
+        fixed = patch_gpx_time.patch_gpx(q, t, max_time_gap_seconds=30).tracks[0].segments[0].points
+        # a query known to be complete past the gap lets the gap be filled before the query resumes
+        patcher = patch_gpx_time.IncrementalTimePatcher(30)
+        output = patcher.add_template_points(template_points)
+        output += patcher.add_query_points(query_points[:30], complete_until=query_points[30].time)
+        self.assertEqual([pt.time for pt in output], [pt.time for pt in fixed[:len(output)]])
+        # (up to the last template point before the query resumes)
+        self.assertEqual(output[-1].time, query_points[30].time - timedelta(seconds=2))
+        output += patcher.add_query_points(query_points[30:])
+        output += patcher.finish()
+        self.assertEqual([pt.time for pt in output], [pt.time for pt in fixed])
+        # each stream must arrive in time order, and keep its complete_until promise
+        patcher = patch_gpx_time.IncrementalTimePatcher(30)
+        patcher.add_query_points(query_points[10:20])
+        with self.assertRaises(ValueError):
+            patcher.add_query_points(query_points[0:10])
+        patcher = patch_gpx_time.IncrementalTimePatcher(30)
+        patcher.add_template_points(template_points, complete_until=template_points[-1].time)
+        patcher.add_query_points(query_points[:30], complete_until=query_points[30].time)
+        with self.assertRaises(ValueError):
+            patcher.add_query_points(query_points[29:])
+        with self.assertRaises(ValueError):
+            patcher.add_template_points(template_points[-2:])
+
+    def test_report_generated(self):
+        # the generated query has a single 46 second gap, which the template covers
+        q, t, _, _ = gen_gpx()
+        gaps = list(gpx_report.iter_gaps(q.tracks[0].segments[0].points,
+                                         max_time_gap_seconds=30,
+                                         template_points=t.tracks[0].segments[0].points))
+        self.assertEqual(len(gaps), 1)
+        self.assertEqual(gaps[0]['start_index'], 29)
+        self.assertEqual(gaps[0]['end_index'], 30)
+        self.assertAlmostEqual(gaps[0]['duration_seconds'], 46, places=2)
+        self.assertGreater(gaps[0]['distance_meters'], 0.0)
+        # template points in the gap: 58, 60, ..., 102 - as patch_gpx inserts them
+        self.assertEqual(gaps[0]['template_points'], 23)
+        fixed = patch_gpx_time.patch_gpx(q, t, 30)
+        query_points = q.tracks[0].segments[0].points
+        query_ids = set(id(pt) for pt in query_points)
+        # (ignoring the template lead in before the query starts)
+        num_inserted = sum(id(pt) not in query_ids and pt.time >= query_points[0].time
+                           for pt in fixed.tracks[0].segments[0].points)
+        self.assertEqual(gaps[0]['template_points'], num_inserted)
+        # without query times, the gap can still be found by distance - but not matched to the template
+        for pt in q.tracks[0].segments[0].points:
+            pt.time = None
+        gaps = list(gpx_report.iter_gaps(q.tracks[0].segments[0].points,
+                                         max_time_gap_seconds=30, dist_thresh=10000,
+                                         template_points=t.tracks[0].segments[0].points))
+        self.assertEqual(len(gaps), 1)
+        self.assertIsNone(gaps[0]['duration_seconds'])
+        self.assertIsNone(gaps[0]['template_points'])
+
+    def test_report_file(self):
+        # the streaming reader should see the same points as gpxpy
+        qfile = '../data/Calero_Mayfair_ranch_trail.gpx'
+        streamed = list(gpx_io.iter_track_points(qfile))
+        gf = open(qfile, 'r')
+        gfp_query = gp.parse(gf)
+        gf.close()
+        parsed = gfp_query.tracks[0].segments[0].points
+        self.assertEqual(len(streamed), len(parsed))
+        self.assertEqual(streamed[-1].time, parsed[-1].time)
+        self.assertAlmostEqual(streamed[-1].latitude, parsed[-1].latitude)
+        self.assertAlmostEqual(streamed[-1].elevation, parsed[-1].elevation)
+        # and the report should agree with the gaps the time patcher fills
+        gaps = list(gpx_report.iter_gaps(streamed, max_time_gap_seconds=30))
+        diffs = [patch_gpx_time.diff_seconds(parsed[i + 1].time, parsed[i].time) for i in range(len(parsed) - 1)]
+        self.assertEqual(len(gaps), sum(d >= 30 for d in diffs))
+
 
 if __name__ == '__main__':
     unittest.main()
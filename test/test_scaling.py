@@ -0,0 +1,170 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import time
+import copy
+from unittest import mock
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+if '..' not in sys.path:
+    sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+from datetime import datetime, timedelta
+
+import gpxpy as gp
+import numpy as np
+import gpx_io
+import gpx_report
+import gpx_stats
+import patch_gpx_spatial
+import patch_gpx_time
+
+# Complexity budgets. These tests run the patchers on synthetic tracks of
+# increasing size and fail if peak memory (tracemalloc) or runtime grows faster
+# than declared - e.g. if a full matrix or a per-point deepcopy creeps back in.
+# growth allowed when the input grows by SCALE for a linear stage
+SCALE = 8
+LINEAR_MEMORY_SLACK = 1.5
+LINEAR_TIME_SLACK = 3.0
+# the time patcher: peak bytes per input point (the output points are shallow copies)
+TIME_PATCH_BYTES_PER_POINT = 200
+# the spatial patcher runs a full DTW - the alignment may hold at most this many
+# float64 query x template matrices, plus a linear term per point
+SPATIAL_MATRICES = 4
+SPATIAL_BYTES_PER_POINT = 2000
+# streaming stages must not grow with the track at all (beyond this slack)
+STREAMING_MEMORY_SLACK = 2.0
+
+
+def gen_gpx_pair(num_points: int, template_interval=1.0) -> (gp.gpx.GPX, gp.gpx.GPX):
+    # a query sampled every 2 seconds with a gap half way (which grows with the
+    # track), and a template covering the query plus a minute either side
+    base_time = datetime(2022, 5, 22, 16, 0, 0)
+    t_query = np.arange(0, num_points) * 2.0
+    t_query[num_points // 2:] += num_points
+    t_template = np.arange(-60, t_query[-1] + 60, template_interval)
+
+    def to_gpx(name, times):
+        gpx = gp.gpx.GPX()
+        gpx.tracks = [gp.gpx.GPXTrack(name=name)]
+        gpx.tracks[0].segments = [gp.gpx.GPXTrackSegment()]
+        for t in times:
+            point = gp.gpx.GPXTrackPoint(37.19 + 1e-5 * t, -121.8 + 1e-3 * np.sin(t / 100.0), elevation=100.0,
+                                         time=base_time + timedelta(seconds=float(t)))
+            # a heart rate extension, like a strava export
+            extension = ET.Element('TrackPointExtension')
+            ET.SubElement(extension, 'hr').text = '120'
+            point.extensions = [extension]
+            gpx.tracks[0].segments[0].points.append(point)
+        return gpx
+
+    return to_gpx('query', t_query), to_gpx('template', t_template)
+
+
+def num_points(*gpxs) -> int:
+    return sum(len(gpx.tracks[0].segments[0].points) for gpx in gpxs)
+
+
+def peak_memory(fn) -> int:
+    # peak bytes allocated while running fn
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_time(fn, repeats=3) -> float:
+    # best of a few runs, to keep the ratios steady
+    best = float('inf')
+    for _ in range(0, repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+class MyTestCase(unittest.TestCase):
+    def test_time_patch_linear(self):
+        small = gen_gpx_pair(1000)
+        large = gen_gpx_pair(1000 * SCALE)
+        small_memory = peak_memory(lambda: patch_gpx_time.patch_gpx(small[0], small[1], 30))
+        large_memory = peak_memory(lambda: patch_gpx_time.patch_gpx(large[0], large[1], 30))
+        print('time patch peak bytes per point:', small_memory / num_points(*small), large_memory / num_points(*large))
+        self.assertLess(large_memory, TIME_PATCH_BYTES_PER_POINT * num_points(*large))
+        self.assertLess(large_memory / small_memory, SCALE * LINEAR_MEMORY_SLACK)
+        small_time = run_time(lambda: patch_gpx_time.patch_gpx(small[0], small[1], 30))
+        large_time = run_time(lambda: patch_gpx_time.patch_gpx(large[0], large[1], 30))
+        print('time patch runtime ratio:', large_time / small_time)
+        self.assertLess(large_time / small_time, SCALE * LINEAR_TIME_SLACK)
+
+    def test_no_per_point_deepcopy(self):
+        # copying whole tracks point by point with deepcopy is slow and memory
+        # hungry; the number of deepcopy calls must not grow with the track
+        calls = []
+        for size in [100, 100 * SCALE]:
+            query, template = gen_gpx_pair(size, template_interval=2.0)
+            with mock.patch.object(copy, 'deepcopy', wraps=copy.deepcopy) as deepcopy:
+                patch_gpx_time.patch_gpx(query, template, 30)
+                patch_gpx_spatial.patch_gpx_tracks(query, template, 50)
+                calls.append(deepcopy.call_count)
+        print('deepcopy calls:', calls)
+        self.assertEqual(calls[0], calls[1])
+
+    def test_spatial_patch_budget(self):
+        # a full DTW is quadratic; check nothing beyond the declared matrices is kept
+        for size in [200, 400, 800]:
+            query, template = gen_gpx_pair(size, template_interval=2.0)
+            len_query = num_points(query)
+            len_template = num_points(template)
+            memory = peak_memory(lambda: patch_gpx_spatial.patch_gpx_tracks(query, template, 50))
+            budget = SPATIAL_MATRICES * 8 * len_query * len_template + \
+                SPATIAL_BYTES_PER_POINT * (len_query + len_template)
+            print('spatial patch peak bytes:', size, memory, 'budget:', budget)
+            self.assertLess(memory, budget)
+
+    def test_streaming_constant(self):
+        # the streaming reader, gap report, incremental patcher and quantiles
+        # should not grow with the length of the track
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            memory = []
+            buffered = []
+            for size in [2000, 2000 * SCALE]:
+                query, template = gen_gpx_pair(size)
+                query_file = os.path.join(tmp_dir, 'query%d.gpx' % size)
+                with open(query_file, 'w') as f:
+                    f.write(query.to_xml())
+
+                def stream():
+                    for _ in gpx_report.iter_gaps(gpx_io.iter_track_points(query_file), max_time_gap_seconds=30):
+                        pass
+                    stats = gpx_stats.StreamingQuantiles()
+                    for ind_start in range(0, size, 1000):
+                        stats.update(np.ones(shape=(1000,)))
+                memory.append(peak_memory(stream))
+                patcher = patch_gpx_time.IncrementalTimePatcher(30)
+                max_buffered = 0
+                query_points = query.tracks[0].segments[0].points
+                template_points = template.tracks[0].segments[0].points
+                template_index = 0
+                for pt in query_points:
+                    patcher.add_query_points([pt])
+                    while template_index < len(template_points) and template_points[template_index].time <= pt.time:
+                        patcher.add_template_points([template_points[template_index]])
+                        template_index += 1
+                    max_buffered = max(max_buffered, patcher.buffered_points())
+                buffered.append(max_buffered)
+            print('streaming peak bytes:', memory, 'incremental buffered points:', buffered)
+            self.assertLess(memory[1] / memory[0], STREAMING_MEMORY_SLACK)
+            self.assertLessEqual(buffered[1], buffered[0] * STREAMING_MEMORY_SLACK)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()